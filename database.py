@@ -3,30 +3,63 @@ Database Helper Functions
 
 MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
+All helpers are coroutines backed by Motor and must be awaited.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
 from datetime import datetime, timezone
+import asyncio
+import logging
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import Optional, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
 db = None
 
+class _ObjectIdStrDecoder(TypeDecoder):
+    """Decode ObjectIds straight to their hex string while reading BSON"""
+    bson_type = ObjectId
+
+    def transform_bson(self, value):
+        return str(value)
+
+_STR_ID_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([_ObjectIdStrDecoder()]))
+
+# Documents waiting to be written by run_batch_writer, as (collection, doc).
+# Created by the writer on its own event loop; None while no writer runs.
+_WRITE_QUEUE_MAXSIZE = 10000
+_write_queue: "Optional[asyncio.Queue[tuple]]" = None
+
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # Pool sized for the expected request concurrency. Writes are acknowledged
+    # by the primary without waiting for the journal: templates and guides can
+    # be regenerated, so insert throughput wins over durability here.
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "5")),
+        maxIdleTimeMS=int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000")),
+        waitQueueTimeoutMS=int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+        retryWrites=True,
+        w=1,
+        journal=False,
+    )
     db = _client[database_name]
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +73,122 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None,
+                        projection: dict = None, str_ids: bool = False, sort: list = None):
+    """Get documents from collection, optionally returning only projected fields.
+
+    With str_ids, ObjectIds are decoded as hex strings instead of ObjectId.
+    sort takes a list of (key, direction) pairs.
+    """
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    coll = db[collection_name]
+    if str_ids:
+        coll = coll.with_options(codec_options=_STR_ID_CODEC_OPTIONS)
+    cursor = coll.find(filter_dict or {}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
-        cursor = cursor.limit(limit)
+        # Fetch everything requested in a single round trip. A negative limit
+        # already means "one batch"; batch_size itself rejects negatives.
+        cursor = cursor.limit(limit).batch_size(abs(limit))
     
-    return list(cursor)
+    # The cursor is already limited; to_list(0) would return nothing
+    return await cursor.to_list(None)
+
+async def estimate_document_count(collection_name: str) -> int:
+    """Count documents in a collection from its metadata (no collection scan)"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    return await db[collection_name].estimated_document_count()
+
+# Order of the template list; _id breaks ties between equal names
+TEMPLATE_LIST_SORT = [("name", 1), ("_id", 1)]
+
+async def ensure_indexes():
+    """Create the indexes the API queries rely on"""
+    if db is None:
+        return
+    try:
+        # Serves list_templates' sort, so limited lists read the index in order
+        await db["template"].create_index(TEMPLATE_LIST_SORT)
+    except Exception:
+        logger.exception("Index creation failed")
+
+async def queue_document(collection_name: str, data: Union[BaseModel, dict]) -> str:
+    """Buffer a document for batched insertion and return its pre-generated id.
+
+    The document is written by run_batch_writer (the app starts it in its
+    lifespan). If no writer is running it is inserted directly instead; if
+    the buffer is full this waits for room.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    if isinstance(data, BaseModel):
+        data_dict = data.model_dump()
+    else:
+        data_dict = data.copy()
+
+    data_dict['_id'] = ObjectId()
+    data_dict['created_at'] = datetime.now(timezone.utc)
+    data_dict['updated_at'] = datetime.now(timezone.utc)
+
+    queue = _write_queue
+    if queue is None:
+        return await create_document(collection_name, data_dict)
+
+    await queue.put((collection_name, data_dict))
+    return str(data_dict['_id'])
+
+async def _flush_batch(batch: list):
+    """Insert a batch of queued documents, one insert_many per collection"""
+    by_collection = {}
+    for collection_name, doc in batch:
+        by_collection.setdefault(collection_name, []).append(doc)
+
+    for collection_name, docs in by_collection.items():
+        try:
+            await db[collection_name].insert_many(docs, ordered=False)
+        except Exception:
+            logger.exception("Batch insert of %d documents into %s failed", len(docs), collection_name)
+
+async def run_batch_writer(max_docs: int = 500, max_wait: float = 0.05):
+    """Drain queued documents into insert_many calls until cancelled.
+
+    A batch is flushed once it holds max_docs documents or max_wait seconds
+    have passed since its first document arrived. Pending documents are
+    flushed on cancellation.
+    """
+    global _write_queue
+    queue = _write_queue = asyncio.Queue(maxsize=_WRITE_QUEUE_MAXSIZE)
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            batch.append(await queue.get())
+            deadline = loop.time() + max_wait
+            while len(batch) < max_docs:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await _flush_batch(batch)
+            batch = []
+    finally:
+        # Later documents are inserted directly by queue_document. Draining
+        # can wake producers blocked on a full queue, so repeat until empty.
+        _write_queue = None
+        while batch or not queue.empty():
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            await _flush_batch(batch)
+            batch = []
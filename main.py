@@ -1,32 +1,88 @@
 import os
-from fastapi import FastAPI, HTTPException
+import hashlib
+import time
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from enum import IntEnum
+from functools import lru_cache
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from bson import ObjectId
+from typing import List, Optional, Dict, Any, Tuple
 
-from database import create_document, get_documents, db
-from schemas import Template as TemplateSchema, Guide as GuideSchema
+from database import create_document, get_documents, estimate_document_count, queue_document, run_batch_writer, ensure_indexes, TEMPLATE_LIST_SORT, db
+from schemas import Template as TemplateSchema
 
-app = FastAPI(title="Design Tutor API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Index creation runs in the background so an unreachable database does
+    # not hold up startup for the server selection timeout
+    indexer = asyncio.create_task(ensure_indexes())
+    # Guides are written in batches by a background task (see queue_document)
+    writer = asyncio.create_task(run_batch_writer()) if db is not None else None
+    yield
+    indexer.cancel()
+    if writer is not None:
+        writer.cancel()
+    for task in (indexer, writer):
+        if task is not None:
+            with suppress(asyncio.CancelledError):
+                await task
+
+app = FastAPI(
+    title="Design Tutor API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+# Comma-separated list of allowed origins; defaults to any origin
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    expose_headers=["Location"],  # create_template returns the new id only here
+    max_age=86400,  # let browsers cache preflight responses for a day
 )
 
+# Compress larger responses (e.g. template lists with a high limit)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Design Tutor Backend Running"}
 
 @app.get("/api/hello")
-def hello():
+async def hello():
     return {"message": "Hello from the backend API!"}
 
+# /test is polled by health probes; its (metadata round-trip) result is
+# reused for _TEST_CACHE_TTL seconds.
+_TEST_CACHE_TTL = 5.0
+# Environment is fixed for the process lifetime (database.py loads .env on import)
+_HAS_DB_URL = bool(os.getenv("DATABASE_URL"))
+_HAS_DB_NAME = bool(os.getenv("DATABASE_NAME"))
+_test_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+
 @app.get("/test")
-def test_database():
+async def test_database():
+    global _test_cache
+    now = time.monotonic()
+    if _test_cache is not None and now - _test_cache[0] < _TEST_CACHE_TTL:
+        return _test_cache[1]
+
+    response = await _database_status()
+    _test_cache = (now, response)
+    return response
+
+async def _database_status() -> Dict[str, Any]:
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -43,7 +99,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -53,35 +109,68 @@ def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    import os as _os
-    response["database_url"] = "✅ Set" if _os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if _os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = "✅ Set" if _HAS_DB_URL else "❌ Not Set"
+    response["database_name"] = "✅ Set" if _HAS_DB_NAME else "❌ Not Set"
 
     return response
 
 # ----------------------------------------------------------------------------
-# Templates: create and list
+# Templates: create, list and fetch
 # ----------------------------------------------------------------------------
 
-@app.post("/api/templates")
-def create_template(payload: TemplateSchema):
+_TEMPLATE_LIST_PROJECTION = {"name": 1, "width": 1, "height": 1, "description": 1}
+
+@app.post("/api/templates", status_code=201, response_class=Response)
+async def create_template(payload: TemplateSchema):
     try:
-        template_id = create_document("template", payload)
-        return {"id": template_id, "status": "created"}
+        template_id = await create_document("template", payload)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    # No body to serialize; the new template is reachable via Location
+    return Response(status_code=201, headers={"Location": f"/api/templates/{template_id}"})
 
 @app.get("/api/templates")
-def list_templates(limit: int = 20):
+async def list_templates(request: Request, limit: int = 20):
     try:
-        docs = get_documents("template", {}, limit)
-        # convert ObjectId
+        # Only the fields shown in the template list; elements can be large
+        docs = await get_documents("template", {}, limit, projection=_TEMPLATE_LIST_PROJECTION,
+                                   str_ids=True, sort=TEMPLATE_LIST_SORT)
         for d in docs:
-            d["id"] = str(d.pop("_id", ""))
-        return {"items": docs}
+            d["id"] = d.pop("_id", "")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Returned directly so the list skips jsonable_encoder. The ETag is a hash
+    # of the encoded body, so any change to the listed fields changes it.
+    response = ORJSONResponse({"items": docs})
+    # Weak: GZipMiddleware sends the same validator for gzip and identity bodies
+    etag = 'W/"%s"' % hashlib.blake2b(response.body, digest_size=8).hexdigest()
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return response
+
+@app.get("/api/templates/count")
+async def count_templates():
+    try:
+        return {"count": await estimate_document_count("template")}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/templates/{template_id}")
+async def get_template(template_id: str):
+    if not ObjectId.is_valid(template_id):
+        raise HTTPException(status_code=404, detail="Template not found")
+    try:
+        docs = await get_documents("template", {"_id": ObjectId(template_id)}, 1, str_ids=True)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not docs:
+        raise HTTPException(status_code=404, detail="Template not found")
+    doc = docs[0]
+    doc["id"] = doc.pop("_id")
+    return doc
+
 # ----------------------------------------------------------------------------
 # Guide generation: analyze a design name/url and produce steps per tool
 # ----------------------------------------------------------------------------
@@ -92,27 +181,27 @@ class GuideRequest(BaseModel):
     tools: List[str] = Field(default_factory=lambda: ["photoshop", "canva", "illustrator"])  
 
 @app.post("/api/guides")
-def generate_guide(req: GuideRequest):
+async def generate_guide(req: GuideRequest):
     detected = _detect_design(req.source_name)
-    steps_map: Dict[str, List[str]] = {}
-    for tool in req.tools:
-        steps_map[tool.lower()] = _build_steps(tool.lower(), detected)
+    steps_map = _build_steps_map(req.tools, detected)
 
-    guide_doc = GuideSchema(
-        source_name=req.source_name,
-        detected=detected,
-        steps=steps_map,
-    )
+    # Plain dict matching schemas.Guide; every field is already built here, so
+    # re-validating through the model would only add overhead.
+    guide_doc = {
+        "source_name": req.source_name,
+        "detected": detected,
+        "steps": steps_map,
+    }
     try:
-        guide_id = create_document("guide", guide_doc)
+        guide_id = await queue_document("guide", guide_doc)
     except Exception:
         guide_id = None
 
     return {
         "id": guide_id,
-        "source_name": guide_doc.source_name,
-        "detected": guide_doc.detected,
-        "steps": guide_doc.steps,
+        "source_name": req.source_name,
+        "detected": detected,
+        "steps": steps_map,
         "image_url": req.image_url,
     }
 
@@ -120,87 +209,171 @@ def generate_guide(req: GuideRequest):
 # Utilities
 # ----------------------------------------------------------------------------
 
-def _detect_design(name: str) -> Dict[str, Any]:
-    name_l = name.lower()
-    layout = "poster"
-    if any(k in name_l for k in ["story", "reel", "vertical", "instagram story"]):
-        layout = "story"
-    elif any(k in name_l for k in ["square", "instagram", "post"]):
-        layout = "square"
-    elif any(k in name_l for k in ["a4", "flyer", "print"]):
-        layout = "a4"
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == opaque for t in if_none_match.split(","))
+
+class Layout(IntEnum):
+    STORY = 0
+    SQUARE = 1
+    POSTER = 2
+    A4 = 3
 
-    palette = ["#0B0F1A", "#FF7A00", "#FFFFFF"] if any(k in name_l for k in ["tech", "futur", "robot"]) else ["#111827", "#E5E7EB", "#FF4D4D"]
-    fonts = ["Inter", "Manrope"] if "modern" in name_l or "tech" in name_l else ["Poppins", "Montserrat"]
+# Names reported in the detected design, indexed by Layout
+_LAYOUT_NAMES: Tuple[str, ...] = tuple(layout.name.lower() for layout in Layout)
 
+# Client strings longer than this skip the lru_caches (and are computed
+# directly) so cache entries stay small
+_MAX_CACHED_KEY_LEN = 256
+
+def _detect_design(name: str) -> Dict[str, Any]:
+    name_l = name.lower()
+    detect = _detect_design_cached if len(name_l) <= _MAX_CACHED_KEY_LEN else _detect_design_cached.__wrapped__
+    layout, palette, fonts, style, position = detect(name_l)
     structure = [
-        {"type": "background", "style": "gradient" if "grad" in name_l else "solid"},
-        {"type": "image", "position": "center" if layout != "story" else "top"},
+        {"type": "background", "style": style},
+        {"type": "image", "position": position},
         {"type": "headline", "weight": "700", "case": "upper"},
         {"type": "subhead", "weight": "500"},
         {"type": "cta", "variant": "pill"}
     ]
 
     return {
-        "layout": layout,
-        "palette": palette,
-        "fonts": fonts,
+        "layout": _LAYOUT_NAMES[layout],
+        "layout_idx": int(layout),
+        "palette": list(palette),
+        "fonts": list(fonts),
         "structure": structure
     }
 
-def _build_steps(tool: str, d: Dict[str, Any]) -> List[str]:
-    size_map = {
-        "story": (1080, 1920),
-        "square": (1080, 1080),
-        "poster": (1080, 1350),
-        "a4": (2480, 3508)
+# Keyword groups used by _detect_design. Keywords match as substrings
+# ("futur" -> "futuristic", "post" -> "poster"), so the name is not tokenized.
+_STORY_KWS = frozenset({"story", "reel", "vertical", "instagram story"})
+_SQUARE_KWS = frozenset({"square", "instagram", "post"})
+_A4_KWS = frozenset({"a4", "flyer", "print"})
+_TECH_KWS = frozenset({"tech", "futur", "robot"})
+
+@lru_cache(maxsize=4096)
+def _detect_design_cached(name_l: str) -> Tuple[Layout, Tuple[str, ...], Tuple[str, ...], str, str]:
+    layout = Layout.POSTER
+    if any(k in name_l for k in _STORY_KWS):
+        layout = Layout.STORY
+    elif any(k in name_l for k in _SQUARE_KWS):
+        layout = Layout.SQUARE
+    elif any(k in name_l for k in _A4_KWS):
+        layout = Layout.A4
+
+    palette = ("#0B0F1A", "#FF7A00", "#FFFFFF") if any(k in name_l for k in _TECH_KWS) else ("#111827", "#E5E7EB", "#FF4D4D")
+    fonts = ("Inter", "Manrope") if "modern" in name_l or "tech" in name_l else ("Poppins", "Montserrat")
+    style = "gradient" if "grad" in name_l else "solid"
+    position = "center" if layout is not Layout.STORY else "top"
+
+    return layout, palette, fonts, style, position
+
+def _build_steps_map(tools: List[str], d: Dict[str, Any]) -> Dict[str, List[str]]:
+    # The design key is built once for all tools, and repeated tools only once
+    key = _design_key(d)
+    steps_map: Dict[str, List[str]] = {}
+    for tool in tools:
+        t = tool.lower()
+        if t not in steps_map:
+            build = _build_steps_cached if len(t) <= _MAX_CACHED_KEY_LEN else _build_steps_cached.__wrapped__
+            steps_map[t] = list(build(t, *key))
+    return steps_map
+
+def _design_key(d: Dict[str, Any]) -> Tuple[int, str, str, Tuple[str, ...], Tuple[str, ...]]:
+    return (
+        d["layout_idx"],
+        d["structure"][0]["style"],
+        d["structure"][1]["position"],
+        tuple(d["palette"]),
+        tuple(d["fonts"]),
+    )
+
+# Canvas size per layout, indexed by Layout
+_SIZES: Tuple[Tuple[int, int], ...] = (
+    (1080, 1920),
+    (1080, 1080),
+    (1080, 1350),
+    (2480, 3508),
+)
+
+# Tool-specific steps wrapped around the common ones. Any tool not listed here
+# falls back to Canva, whose second step depends on the canvas size.
+_PREFIX: Dict[str, Tuple[str, ...]] = {
+    "photoshop": (
+        "Open Photoshop.",
+        "File > New.",
+        "Use Shape layers and Smart Objects for non-destructive editing.",
+    ),
+    "illustrator": (
+        "Open Illustrator.",
+        "File > New (RGB).",
+        "Use rectangles and Type tool; keep elements on separate layers.",
+    ),
+}
+_SUFFIX: Dict[str, Tuple[str, ...]] = {
+    "photoshop": (
+        "Group layers (BG, Image, Text, CTA).",
+        "Save as PSD and export PNG.",
+    ),
+    "illustrator": (
+        "Convert shapes to symbols for reusability.",
+        "Save as AI and export PNG.",
+    ),
+}
+_CANVA_SIZE_STEP = "Create a custom size {}x{}."
+_CANVA_SUFFIX: Tuple[str, ...] = (
+    "Use Position > Tidy up to align elements.",
+    "Download PNG and save the design as a template.",
+)
+
+# Steps shared by every tool, filled in from the detected design
+_COMMON_TMPL: Tuple[str, ...] = (
+    "Create a new document sized {w}x{h} px.",
+    "Set background to {background}.",
+    "Place the main image {placement} and size it proportionally.",
+    "Add a bold headline using {headline_font} and align left.",
+    "Add supporting text with {body_font} and reduce tracking slightly.",
+    "Create a call-to-action button using {accent} and white text.",
+    "Export as high-quality PNG (and save the source file as a reusable template).",
+)
+
+@lru_cache(maxsize=4096)
+def _build_steps_cached(tool: str, layout: int, style: str, position: str,
+                        palette: Tuple[str, ...], fonts: Tuple[str, ...]) -> Tuple[str, ...]:
+    w, h = _SIZES[layout]
+
+    subs = {
+        "w": w,
+        "h": h,
+        "background": "a subtle radial gradient" if style == "gradient" else palette[0],
+        "placement": "centered" if position == "center" else "near the top",
+        "headline_font": fonts[0],
+        "body_font": fonts[-1],
+        "accent": palette[1],
     }
-    w, h = size_map.get(d.get("layout", "poster"), (1080, 1350))
-
-    common = [
-        f"Create a new document sized {w}x{h} px.",
-        f"Set background to {'a subtle radial gradient' if d['structure'][0]['style']=='gradient' else d['palette'][0]}.",
-        f"Place the main image {'centered' if d['structure'][1]['position']=='center' else 'near the top'} and size it proportionally.",
-        f"Add a bold headline using {d['fonts'][0]} and align left.",
-        f"Add supporting text with {d['fonts'][-1]} and reduce tracking slightly.",
-        f"Create a call-to-action button using {d['palette'][1]} and white text.",
-        "Export as high-quality PNG (and save the source file as a reusable template)."
-    ]
+    common = tuple(t.format_map(subs) for t in _COMMON_TMPL)
 
-    if tool == "photoshop":
-        prefix = [
-            "Open Photoshop.",
-            "File > New.",
-            "Use Shape layers and Smart Objects for non-destructive editing.",
-        ]
-        suffix = [
-            "Group layers (BG, Image, Text, CTA).",
-            "Save as PSD and export PNG.",
-        ]
-    elif tool == "illustrator":
-        prefix = [
-            "Open Illustrator.",
-            "File > New (RGB).",
-            "Use rectangles and Type tool; keep elements on separate layers.",
-        ]
-        suffix = [
-            "Convert shapes to symbols for reusability.",
-            "Save as AI and export PNG.",
-        ]
-    else:  # canva
-        prefix = [
+    prefix = _PREFIX.get(tool)
+    if prefix is None:  # canva
+        prefix = (
             "Open Canva.",
-            f"Create a custom size {w}x{h}.",
+            _CANVA_SIZE_STEP.format(w, h),
             "Add a gradient or color rectangle as background.",
-        ]
-        suffix = [
-            "Use Position > Tidy up to align elements.",
-            "Download PNG and save the design as a template.",
-        ]
+        )
+        suffix = _CANVA_SUFFIX
+    else:
+        suffix = _SUFFIX[tool]
 
     return prefix + common + suffix
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools")